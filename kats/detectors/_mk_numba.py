@@ -0,0 +1,77 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+# pyre-unsafe
+
+"""Numba kernels for the Mann-Kendall trend detector.
+
+Importing this module requires numba; `kats.detectors.trend_mk` falls back to
+its pure Python implementation when it is not installed.
+"""
+
+from typing import Tuple
+
+import numpy as np
+from numba import njit, prange  # @manual
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def mk_rolling(
+    x: np.ndarray, w: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Runs the original Mann-Kendall test on all sliding windows of x.
+
+    Missing values are skipped within each window, as in the pure Python test.
+
+    Args:
+        x: 1-dim float array of observations.
+        w: the window size.
+
+    Returns:
+        (tuple): tuple of arrays of length len(x) - w + 1, where item i is
+            computed on x[i : i + w]:
+
+            s: Mann-Kendall score.
+            var_s: variance of s, corrected for ties.
+            Tau: Kendall Tau, nan if the window has less than two observations.
+            z: normalized test statistic.
+    """
+
+    m = len(x) - w + 1
+    s = np.zeros(m, dtype=np.int64)
+    var_s = np.zeros(m)
+    Tau = np.full(m, np.nan)
+    z = np.zeros(m)
+
+    for i in prange(m):
+        n = 0
+        s_i = 0
+        tie_term = 0
+        for j in range(w):
+            x_j = x[i + j]
+            if np.isnan(x_j):
+                continue
+            n += 1
+            # t counts the observations tied with x_j, including itself
+            t = 0
+            for k in range(w):
+                x_k = x[i + k]
+                if x_k == x_j:
+                    t += 1
+                elif k > j:
+                    # comparisons with nan are False and add nothing
+                    s_i += (x_k > x_j) - (x_k < x_j)
+            # each of the t tied values adds (t - 1) * (2t + 5)
+            tie_term += (t - 1) * (2 * t + 5)
+
+        s[i] = s_i
+        var_s[i] = (n * (n - 1) * (2 * n + 5) - tie_term) / 18
+        if n > 1:
+            Tau[i] = s_i / (0.5 * n * (n - 1))
+        if s_i > 0:
+            z[i] = (s_i - 1) / np.sqrt(var_s[i])
+        elif s_i < 0:
+            z[i] = (s_i + 1) / np.sqrt(var_s[i])
+
+    return s, var_s, Tau, z
@@ -6,7 +6,9 @@
 
 from __future__ import annotations
 
+import hashlib
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
 from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
@@ -16,13 +18,15 @@ import numpy as np
 import pandas as pd
 
 try:
-    import pymannkendall as mk
+    from kats.detectors._mk_numba import mk_rolling
 
-    _no_mk = False
+    _no_numba = False
 except ImportError:
-    _no_mk = True
+    _no_numba = True
 from kats.consts import TimeSeriesChangePoint, TimeSeriesData
 from kats.detectors.detector import Detector
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.stats import norm  # @manual
 from statsmodels.tsa.api import SimpleExpSmoothing
 
 """Mann-Kendall (MK) Trend Detector Module
@@ -64,8 +68,6 @@ class MKChangePoint(TimeSeriesChangePoint):
         Tau: Union[float, Dict],
     ):
         super().__init__(start_time, end_time, confidence)
-        if _no_mk:
-            raise RuntimeError("requires pymannkendall to be installed")
         self._detector_type = MKDetector
         self._is_multivariate = is_multivariate
         self._trend_direction = trend_direction
@@ -97,6 +99,281 @@ class MKChangePoint(TimeSeriesChangePoint):
         )
 
 
+def _merge_count_inversions(y: List[int]) -> Tuple[List[int], int]:
+    """Sorts y with merge sort and counts the number of inversions in it."""
+
+    n = len(y)
+    if n < 2:
+        return y, 0
+
+    left, inv_left = _merge_count_inversions(y[: n // 2])
+    right, inv_right = _merge_count_inversions(y[n // 2 :])
+
+    merged = []
+    inv = inv_left + inv_right
+    i, j = 0, 0
+    while i < len(left) and j < len(right):
+        if left[i] <= right[j]:
+            merged.append(left[i])
+            i += 1
+        else:
+            merged.append(right[j])
+            j += 1
+            # right[j] precedes every remaining element of left
+            inv += len(left) - i
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+
+    return merged, inv
+
+
+def _mk_s_knight(x: np.ndarray) -> Tuple[int, int]:
+    """Computes the Mann-Kendall score S with Knight's O(n log n) algorithm.
+
+    Knight (1966): once the time indices are ordered by value, the number of
+    discordant pairs is the number of inversions left in the time indices,
+    which a merge sort counts in O(n log n) instead of the O(n^2) double sum.
+
+    Args:
+        x: 1-dim array of observations without missing values.
+
+    Returns:
+        (tuple): tuple containing:
+
+            s(int): Mann-Kendall score, the sum of sgn(x_j - x_i) over i < j.
+            tie_term(int): sum of t * (t - 1) * (2t + 5) over the groups of t
+                tied values, the tie correction of Var(S).
+    """
+
+    n = len(x)
+    # a stable sort keeps tied values in time order, so that tied pairs are
+    # not counted as inversions
+    order = np.argsort(x, kind="mergesort")
+    _, discordant = _merge_count_inversions(order.tolist())
+
+    _, t = np.unique(x, return_counts=True)
+    tied_pairs = int(np.sum(t * (t - 1) // 2))
+    tie_term = int(np.sum(t * (t - 1) * (2 * t + 5)))
+
+    # concordant - discordant, where concordant = n(n-1)/2 - ties - discordant
+    s = n * (n - 1) // 2 - tied_pairs - 2 * discordant
+
+    return s, tie_term
+
+
+def _mk_s_swar(x: np.ndarray) -> Tuple[int, int]:
+    """Computes the Mann-Kendall score S from all pairwise signs at once.
+
+    The values are replaced by their dense ranks packed in int8, so that the
+    n x n comparisons are branchless vectorized numpy operations on one byte
+    per pair, rather than the Python merge sort of `_mk_s_knight`.
+
+    Args:
+        x: 1-dim array of at most `_SWAR_MAX_LEN` observations without missing
+            values.
+
+    Returns:
+        The same (s, tie_term) tuple as `_mk_s_knight`.
+    """
+
+    _, ranks, t = np.unique(x, return_inverse=True, return_counts=True)
+    ranks = ranks.astype(np.int8)
+    later, earlier = ranks[None, :], ranks[:, None]
+    sign = (later > earlier).view(np.int8) - (later < earlier).view(np.int8)
+
+    s = int(np.triu(sign, k=1).sum())
+    tie_term = int(np.sum(t * (t - 1) * (2 * t + 5)))
+
+    return s, tie_term
+
+
+# dense ranks of up to 128 values fit in int8
+_SWAR_MAX_LEN = 128
+
+
+def _mk_score(x: np.ndarray) -> Tuple[int, int]:
+    """Computes the Mann-Kendall score S and the tie term of Var(S).
+
+    Uses `_mk_s_swar` when the ranks fit in int8 and `_mk_s_knight` otherwise.
+    On random data the int8 kernel took about half the time of the merge sort
+    from 30 up to 128 values; at 20 values or fewer both are dominated by call
+    overhead and the merge sort can be slightly faster.
+    """
+
+    if len(x) <= _SWAR_MAX_LEN:
+        return _mk_s_swar(x)
+    return _mk_s_knight(x)
+
+
+def _mk_original_test(x: np.ndarray, alpha: float = 0.05) -> Tuple[str, float, float]:
+    """Performs the original Mann-Kendall test on x.
+
+    Matches `pymannkendall.original_test`, without computing the unused Sen's
+    slope.
+
+    Args:
+        x: 1-dim array of observations without missing values.
+        alpha: significance level.
+
+    Returns:
+        (tuple): tuple containing:
+
+            trend(str): tells the trend (decreasing, increasing, or no trend)
+            p(float): p-value of the significance test
+            Tau(float): Kendall Tau
+
+    Raises:
+        ZeroDivisionError: x has less than two observations.
+    """
+
+    n = len(x)
+    s, tie_term = _mk_score(x)
+    var_s = (n * (n - 1) * (2 * n + 5) - tie_term) / 18
+    Tau = s / (0.5 * n * (n - 1))
+
+    z = _mk_z_score(s, var_s)
+    p, trend = _mk_p_value(z, alpha)
+
+    return str(trend), float(p), Tau
+
+
+# upper bound on the pairwise comparisons _mk_score_ndim holds in memory at
+# once, 32 MiB of int64 signs and 4 MiB for each bool comparison
+_MK_NDIM_MAX_PAIRS = 2**22
+
+
+def _mk_score_block(
+    later: np.ndarray, earlier: np.ndarray, offset: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compares a block of rows of series with all their observations.
+
+    Args:
+        later: array of shape (batch, 1, n) holding the series.
+        earlier: array of shape (batch, rows, 1) holding the observations
+            offset to offset + rows of the series.
+        offset: index of the first row of the block.
+
+    Returns:
+        (tuple): tuple containing:
+
+            s: array of shape (batch,), the part of the Mann-Kendall score of
+                each series contributed by the pairs starting in the block.
+            t: array of shape (batch, rows), the number of values tied with
+                each observation of the block, including itself.
+    """
+
+    # pair (i, j) compares x[:, j] with x[:, i] and counts for j > i;
+    # comparisons with nan are False, so missing values add nothing
+    sign = (later > earlier).astype(np.int64)
+    sign -= later < earlier
+    sign *= (
+        np.arange(later.shape[-1])
+        > np.arange(offset, offset + earlier.shape[1])[:, None]
+    )
+    t = (later == earlier).sum(axis=-1)
+
+    return sign.sum(axis=(-2, -1)), t
+
+
+def _mk_score_ndim(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Computes the Mann-Kendall score of many series at once.
+
+    The pairwise signs of the series are obtained in broadcast (batch, rows, n)
+    comparisons rather than by testing the series one by one. Each block holds
+    at most _MK_NDIM_MAX_PAIRS comparisons, batching short series together and
+    splitting the rows of long ones, to bound the peak memory. Missing values
+    are skipped within each series.
+
+    Args:
+        x: array of shape (..., n) holding one series along its last axis, such
+            as the (c, n) metrics of a window or the (m, c, n) sliding windows
+            of a multivariate time series.
+
+    Returns:
+        (tuple): tuple of arrays of shape x.shape[:-1] containing:
+
+            s: Mann-Kendall score of each series.
+            var_s: variance of s, corrected for ties.
+            n: number of observations in each series.
+    """
+
+    shape, w = x.shape[:-1], x.shape[-1]
+    x = x.reshape(-1, w)
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=-1)
+    s = np.zeros(len(x), dtype=np.int64)
+    tie_term = np.zeros(len(x), dtype=np.int64)
+
+    batch_size = max(1, _MK_NDIM_MAX_PAIRS // max(1, w * w))
+    rows = max(1, min(w, _MK_NDIM_MAX_PAIRS // max(1, batch_size * w)))
+    for start in range(0, len(x), batch_size):
+        batch = slice(start, start + batch_size)
+        later = x[batch, None, :]
+        for i in range(0, w, rows):
+            s_i, t = _mk_score_block(later, x[batch, i : i + rows, None], i)
+            s[batch] += s_i
+            # each of the t tied values adds (t - 1) * (2t + 5) to the tie
+            # correction
+            tie_i = np.where(valid[batch, i : i + rows], (t - 1) * (2 * t + 5), 0)
+            tie_term[batch] += tie_i.sum(axis=-1)
+
+    var_s = (n * (n - 1) * (2 * n + 5) - tie_term) / 18
+
+    return s.reshape(shape), var_s.reshape(shape), n.reshape(shape)
+
+
+def _mk_z_score(
+    s: Union[int, np.ndarray], var_s: Union[float, np.ndarray]
+) -> np.ndarray:
+    """Normalized test statistic z of the Mann-Kendall score s.
+
+    Works elementwise when s and var_s are arrays.
+    """
+
+    s = np.asarray(s)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (s - np.sign(s)) / np.sqrt(var_s)
+
+    return np.where(s == 0, 0.0, z)
+
+
+def _mk_p_value(
+    z: Union[float, np.ndarray], alpha: float = 0.05
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Two tail test of the normalized Mann-Kendall statistic z.
+
+    Works elementwise when z is an array.
+
+    Returns:
+        (tuple): tuple containing:
+
+            p(np.ndarray): p-value of the significance test
+            trend(np.ndarray): tells the trend (decreasing, increasing, or no
+                trend)
+    """
+
+    z = np.asarray(z)
+    p = 2 * (1 - norm.cdf(np.abs(z)))
+    h = np.abs(z) > norm.ppf(1 - alpha / 2)
+    trend = np.where(
+        h & (z < 0), "decreasing", np.where(h & (z > 0), "increasing", "no trend")
+    )
+
+    return p, trend
+
+
+# number of detector() results kept by each MKDetector
+_MK_STATISTICS_CACHE_SIZE = 8
+
+
+def _fingerprint(ts: pd.DataFrame) -> str:
+    """Hashes the values, index and column names of ts."""
+
+    h = hashlib.sha1(pd.util.hash_pandas_object(ts).to_numpy().tobytes())
+    h.update(repr(list(ts.columns)).encode())
+    return h.hexdigest()
+
+
 class MKDetector(Detector):
     """
     MKDetector (MK stands for Mann-Kendall) is a non-parametric statistical test
@@ -152,13 +429,14 @@ class MKDetector(Detector):
         # pyre-fixme[6]: Expected `TimeSeriesData` for 1st param but got
         #  `Optional[TimeSeriesData]`.
         super(MKDetector, self).__init__(data=data)
-        if _no_mk:
-            raise RuntimeError("requires pymannkendall to be installed")
 
         self.threshold = threshold
         self.alpha = alpha
         self.multivariate = multivariate
         self.__subtype__ = "trend_detector"
+        # MK statistics by data fingerprint and detector() parameters, least
+        # recently used first
+        self._MK_statistics_cache: OrderedDict[Tuple, pd.DataFrame] = OrderedDict()
 
         # Assume univariate but multivariate data is detected
         if self.data is not None:
@@ -190,7 +468,9 @@ class MKDetector(Detector):
             assert ts_c is not None
             with np.errstate(divide="raise"):
                 try:
-                    model = SimpleExpSmoothing(ts_c)
+                    # statsmodels is not accurate in single precision, a
+                    # constant float32 series gets smoothed into a trend
+                    model = SimpleExpSmoothing(ts_c.astype(float, copy=False))
                     _fit = model.fit(smoothing_level=0.2, optimized=False)
                     smoothed_ts_tmp = _fit.predict(
                         start=ts_c.index[0],
@@ -273,8 +553,7 @@ class MKDetector(Detector):
 
         anchor_date = ts.index[-1]
 
-        mk_result = mk.original_test(x)
-        trend, p, Tau = mk_result.trend, mk_result.p, mk_result.Tau
+        trend, p, Tau = _mk_original_test(x)
         trend = self._apply_threshold(trend, Tau)
 
         return anchor_date, trend, p, Tau
@@ -305,32 +584,72 @@ class MKDetector(Detector):
 
         anchor_date = ts.index[-1]
 
-        Tau_dict = {}  # contains score for individual cluster and overall
-        trend_dict = {}  # contains trend for individual cluster and overall
-
         x, c = self._preprocessing(ts)
+        x = x.reshape(len(x), c)
 
-        multi_mk_result = mk.multivariate_test(x)
-        trend, p, Tau = multi_mk_result.trend, multi_mk_result.p, multi_mk_result.Tau
-        trend = self._apply_threshold(trend, Tau)
+        # scores of all metrics at once
+        s, var_s, n = _mk_score_ndim(x.T)
+        trend, p, Tau = self._multivariate_statistics(
+            s[None], var_s[None], n[None], ts.columns
+        )
 
-        Tau_dict["overall"] = Tau
-        trend_dict["overall"] = trend
+        return anchor_date, trend[0], float(p[0]), Tau[0]
 
-        for i in range(c):
-            x_i, n = self._drop_missing_values(x[:, i])
-            # individual Tau score and trend
-            try:
-                mk_result = mk.original_test(x_i)
-                trend_i, Tau_i = mk_result.trend, mk_result.Tau
-                trend_i = self._apply_threshold(trend_i, Tau_i)
-                Tau_dict[ts.columns[i]] = Tau_i
-                trend_dict[ts.columns[i]] = trend_i
-            except ZeroDivisionError:
-                Tau_dict[ts.columns[i]] = None
-                trend_dict[ts.columns[i]] = None
+    def _multivariate_statistics(
+        self,
+        s: np.ndarray,
+        var_s: np.ndarray,
+        n: np.ndarray,
+        columns: Sequence[str],
+    ) -> Tuple[List[Dict], np.ndarray, List[Dict]]:
+        """Combines the MK scores of each metric into Multivariate MK tests.
 
-        return anchor_date, trend_dict, p, Tau_dict
+        The overall score and variance are the sums over all metrics.
+
+        Args:
+            s: array of shape (m, c), MK score of c metrics in m windows.
+            var_s: array of shape (m, c), variance of s.
+            n: array of shape (m, c), number of observations behind s.
+            columns: names of the c metrics.
+
+        Returns:
+            (tuple): tuple containing, for each of the m windows:
+
+                trend_dicts: trend of each metric and the overall trend, as in
+                    multivariate_MKtest.
+                p: p-value of the significance test.
+                Tau_dicts: Kendall Tau of each metric and the overall Tau.
+        """
+
+        denom = 0.5 * n * (n - 1)
+        Tau = s.sum(axis=1) / denom.sum(axis=1)
+        p, trend = _mk_p_value(_mk_z_score(s.sum(axis=1), var_s.sum(axis=1)))
+
+        # individual Tau score and trend
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Tau_c = s / denom
+        _, trend_c = _mk_p_value(_mk_z_score(s, var_s))
+
+        trend_dicts, Tau_dicts = [], []
+        for k in range(len(s)):
+            # contains score for individual cluster and overall
+            Tau_dict = {"overall": Tau[k]}
+            # contains trend for individual cluster and overall
+            trend_dict = {"overall": self._apply_threshold(str(trend[k]), Tau[k])}
+            for i, column in enumerate(columns):
+                if n[k, i] < 2:
+                    Tau_dict[column] = None
+                    trend_dict[column] = None
+                else:
+                    Tau_i = float(Tau_c[k, i])
+                    Tau_dict[column] = Tau_i
+                    trend_dict[column] = self._apply_threshold(
+                        str(trend_c[k, i]), Tau_i
+                    )
+            trend_dicts.append(trend_dict)
+            Tau_dicts.append(Tau_dict)
+
+        return trend_dicts, p, Tau_dicts
 
     def runDetector(self, ts: pd.DataFrame) -> Dict[str, Any]:
         """Runs MK test for a time point in the input data.
@@ -352,6 +671,123 @@ class MKDetector(Detector):
 
         return {"ds": anchor_date, "trend_direction": trend, "p": p, "Tau": Tau}
 
+    def _rolling_MKtest(self, ts: pd.DataFrame) -> pd.DataFrame:
+        """Runs MK test for all time points of the input data at once.
+
+        Equivalent to calling runDetector on the look back window of each time
+        point in ts.index[window_size:]. The windows are strided views of ts;
+        univariate data is scored by the numba kernel `mk_rolling` when numba
+        is installed.
+
+        Args:
+            ts: the dataframe of input data with noise and seasonality removed.
+                Its index is time.
+
+        Returns:
+            A dataframe of MK test statistics with one row per time point,
+                including trend, p-value and Kendall Tau.
+        """
+
+        window_size = self.window_size
+        assert window_size is not None
+
+        # seasonality removal can leave no time point with a full look back
+        # window, even though detector() checked the length of the raw data
+        if len(ts) <= window_size:
+            return pd.DataFrame(columns=["ds", "trend_direction", "p", "Tau"])
+
+        x = ts.to_numpy()
+        if not np.issubdtype(x.dtype, np.floating):
+            x = x.astype(float)
+
+        # window i ends at ts.index[i + window_size - 1], skip the first one
+        if self.multivariate:
+            # (m, c, window_size) view of the look back windows
+            windows = sliding_window_view(x, window_size, axis=0)[1:]
+            s, var_s, n = _mk_score_ndim(windows)
+            trend, p, Tau = self._multivariate_statistics(s, var_s, n, ts.columns)
+        else:
+            x = x[:, 0]
+            if _no_numba:
+                windows = sliding_window_view(x, window_size)[1:]
+                s, var_s, n = _mk_score_ndim(windows)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    Tau = s / (0.5 * n * (n - 1))
+                z = _mk_z_score(s, var_s)
+            else:
+                _, _, Tau, z = mk_rolling(x, window_size)
+                Tau, z = Tau[1:], z[1:]
+
+            p, trend = _mk_p_value(z)
+            trend[np.abs(Tau) <= self.threshold] = "no trend"
+
+        return pd.DataFrame(
+            {
+                "ds": ts.index[window_size:],
+                "trend_direction": trend,
+                "p": p,
+                "Tau": Tau,
+            }
+        )
+
+    def _get_MK_statistics(self, ts: pd.DataFrame) -> pd.DataFrame:
+        """Runs MK test on ts with the parameters of the latest detector call.
+
+        Args:
+            ts: the dataframe of input data with time as index.
+
+        Returns:
+            The dataframe of MK test statistics of the anchor date, or of all
+                time points when training_days is None.
+        """
+
+        window_size = self.window_size
+        assert window_size is not None
+        training_days = self.training_days
+        freq = self.freq
+
+        # save the trend detection results to dataframe MK_statistics
+        MK_statistics = pd.DataFrame(columns=["ds", "trend_direction", "p", "Tau"])
+
+        if training_days is not None:  # anchor date analysis for real-time setting
+            # only look back training_days for noise and seasonality removal
+            start = ts.index[-1] - timedelta(days=training_days)
+            ts = ts.loc[start : ts.index[-1], :]
+            # deseasonalization
+            ts_deseas = self._remove_seasonality(ts, freq=self.freq)
+            ts_smoothed = self._smoothing(ts_deseas)  # smoothing
+            # append MK statistics to MK_statistics dataframe
+            MK_statistics = MK_statistics.append(
+                # pyre-ignore[6]: Expected `Union[Dict[Union[int, str], typing.Any], L...
+                self.runDetector(ts=ts_smoothed),
+                ignore_index=True,
+            )
+
+        else:
+            # use the whole time series for for noise and seasonality removal
+            ts_deseas = self._remove_seasonality(ts, freq=freq)
+            ts_smoothed = self._smoothing(ts_deseas)
+
+            if ts_smoothed.values.dtype != object and (
+                self.multivariate or ts_smoothed.shape[1] == 1
+            ):
+                # run detector on all sliding windows at once
+                MK_statistics = self._rolling_MKtest(ts_smoothed)
+            else:
+                # run detector sequentially with sliding_window for the whole
+                # time series
+                for t in ts_smoothed.index[window_size:]:
+                    # look back window_size day for trend detection
+                    ts_tmp = ts_smoothed.loc[:t, :]
+                    # append MK statistics to MK_statistics dataframe
+                    MK_statistics = MK_statistics.append(
+                        # pyre-ignore[6]: Expected `Union[Dict[Union[int, str], ty...
+                        self.runDetector(ts=ts_tmp),
+                        ignore_index=True,
+                    )
+
+        return MK_statistics
+
     # pyre-fixme[14]: `detector` overrides method defined in `Detector` inconsistently.
     def detector(
         self,
@@ -417,40 +853,31 @@ class MKDetector(Detector):
                     f"at least training_days={training_days} points."
                 )
 
-        # save the trend detection results to dataframe MK_statistics
-        MK_statistics = pd.DataFrame(columns=["ds", "trend_direction", "p", "Tau"])
-
-        if training_days is not None:  # anchor date analysis for real-time setting
-            # only look back training_days for noise and seasonality removal
-            start = ts.index[-1] - timedelta(days=training_days)
-            ts = ts.loc[start : ts.index[-1], :]
-            # deseasonalization
-            ts_deseas = self._remove_seasonality(ts, freq=self.freq)
-            ts_smoothed = self._smoothing(ts_deseas)  # smoothing
-            # append MK statistics to MK_statistics dataframe
-            MK_statistics = MK_statistics.append(
-                # pyre-ignore[6]: Expected `Union[Dict[Union[int, str], typing.Any], L...
-                self.runDetector(ts=ts_smoothed),
-                ignore_index=True,
-            )
-
+        # reuse the MK statistics of an earlier call with the same data and
+        # parameters; the data is fingerprinted since it can change in place
+        key = (
+            _fingerprint(ts),
+            window_size,
+            training_days,
+            freq,
+            self.threshold,
+            self.multivariate,
+        )
+        cached = self._MK_statistics_cache.get(key)
+        if cached is None:
+            cached = self._get_MK_statistics(ts)
+            self._MK_statistics_cache[key] = cached
+            if len(self._MK_statistics_cache) > _MK_STATISTICS_CACHE_SIZE:
+                self._MK_statistics_cache.popitem(last=False)
         else:
-            # use the whole time series for for noise and seasonality removal
-            ts_deseas = self._remove_seasonality(ts, freq=freq)
-            ts_smoothed = self._smoothing(ts_deseas)
-
-            # run detector sequentially with sliding_window for the whole time
-            # series
-            for t in ts_smoothed.index[window_size:]:
-                # look back window_size day for trend detection
-                ts_tmp = ts_smoothed.loc[:t, :]
-                # append MK statistics to MK_statistics dataframe
-                MK_statistics = MK_statistics.append(
-                    # pyre-ignore[6]: Expected `Union[Dict[Union[int, str], typing.Any...
-                    self.runDetector(ts=ts_tmp),
-                    ignore_index=True,
-                )
+            self._MK_statistics_cache.move_to_end(key)
 
+        # callers may edit self.MK_statistics, keep the cached frame private;
+        # copy() does not copy the per metric dicts of multivariate data
+        MK_statistics = cached.copy()
+        if self.multivariate:
+            for c in ["trend_direction", "Tau"]:
+                MK_statistics[c] = MK_statistics[c].map(dict)
         self.MK_statistics = MK_statistics
 
         # take the subset for detection with specified trend_direction
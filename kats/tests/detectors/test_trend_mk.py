@@ -4,85 +4,155 @@
 
 # pyre-unsafe
 
-import re
-from operator import attrgetter
-from unittest import TestCase
-
+from functools import lru_cache
+from itertools import product
+from typing import List, Tuple
+from unittest import mock, skipIf, TestCase
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import statsmodels
-from kats.detectors.trend_mk import MKDetector
+import pytest
+from kats.consts import TimeSeriesData
+from kats.detectors import trend_mk
+from kats.detectors.trend_mk import (
+    MKChangePoint,
+    MKDetector,
+    _mk_original_test,
+    _mk_s_knight,
+    _mk_s_swar,
+    _mk_score_ndim,
+    _SWAR_MAX_LEN,
+)
 from kats.tests.detectors.utils import gen_no_trend_data_ndim, gen_trend_data_ndim
-from parameterized.parameterized import parameterized
+from scipy.stats import norm  # @manual
 
-statsmodels_ver = float(
-    re.findall("([0-9]+\\.[0-9]+)\\..*", statsmodels.__version__)[0]
-)
+try:
+    from kats.detectors._mk_numba import mk_rolling
+
+    _no_numba = False
+except ImportError:
+    _no_numba = True
+
+# render the plot tests off screen
+matplotlib.use("Agg", force=True)
+
+
+def _detected_ds(
+    detector: MKDetector, MK_statistics: pd.DataFrame, direction: str
+) -> np.ndarray:
+    return detector.get_MK_results(MK_statistics, direction=direction)["ds"].values
+
+
+# the synthetic series only depend on their arguments, so generate each of them
+# once per module; time is passed as a hashable tuple of int64 nanoseconds
+@lru_cache(maxsize=None)
+def _gen_no_trend(time_ns: Tuple[int, ...], ndim: int = 1) -> TimeSeriesData:
+    return gen_no_trend_data_ndim(time=pd.Series(pd.to_datetime(time_ns)), ndim=ndim)
+
+
+@lru_cache(maxsize=None)
+def _gen_trend(
+    time_ns: Tuple[int, ...], seasonality: float = 0.0, ndim: int = 1
+) -> Tuple[TimeSeriesData, List[int]]:
+    trend_data, t_change = gen_trend_data_ndim(
+        time=pd.Series(pd.to_datetime(time_ns)), seasonality=seasonality, ndim=ndim
+    )
+    return trend_data, t_change
 
 
 class UnivariateMKDetectorTest(TestCase):
-    def setUp(self) -> None:
-        self.window_size = 20
-        self.time = pd.Series(
-            pd.date_range(start="2020-01-01", end="2020-06-20", freq="1D")
-        )
-        no_trend_data = gen_no_trend_data_ndim(time=self.time)
-        trend_data, self.t_change = gen_trend_data_ndim(time=self.time)
-        trend_seas_data, self.t_change_seas = gen_trend_data_ndim(
-            time=self.time, seasonality=0.07
-        )
+    # with pytest-xdist, --dist loadgroup runs each class on its own worker
+    pytestmark = pytest.mark.xdist_group(name="mk_univariate")
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.window_size = 20
+        dates = pd.date_range(start="2020-01-01", end="2020-06-20", freq="1D")
+        cls.time = dates.to_series(index=range(len(dates)))
+        # compare datetime64 values in the tests rather than boxed Timestamps
+        cls.time_values = cls.time.values
+        cls._time_ns = cls.time_values.astype("datetime64[ns]").view("int64")
+        time_ns = tuple(cls._time_ns)
+        no_trend_data = _gen_no_trend(time_ns)
+        trend_data, cls.t_change = _gen_trend(time_ns)
+        trend_seas_data, cls.t_change_seas = _gen_trend(time_ns, seasonality=0.07)
 
         # no trend data
-        self.d_no_trend = MKDetector(data=no_trend_data)
-        self.detected_time_points_no_trend = self.d_no_trend.detector(
-            window_size=self.window_size
+        cls.d_no_trend = MKDetector(data=no_trend_data)
+        cls.detected_time_points_no_trend = cls.d_no_trend.detector(
+            window_size=cls.window_size
         )
 
         # trend data
-        self.d_trend = MKDetector(data=trend_data)
-        self.detected_time_points_trend = self.d_trend.detector(
-            window_size=self.window_size
+        cls.d_trend = MKDetector(data=trend_data)
+        cls.detected_time_points_trend = cls.d_trend.detector(
+            window_size=cls.window_size
         )
-        self.metadata_trend = self.detected_time_points_trend[0]
-        results_trend = self.d_trend.get_MK_statistics()
-        self.up_trend_detected_trend = self.d_trend.get_MK_results(
-            results_trend, direction="up"
-        )["ds"]
-        self.down_trend_detected_trend = self.d_trend.get_MK_results(
-            results_trend, direction="down"
-        )["ds"]
+        cls.results_trend = cls.d_trend.get_MK_statistics()
 
         # trend data anchor point
-        self.detected_time_points_trend2 = self.d_trend.detector(training_days=30)
-        results_trend2 = self.d_trend.get_MK_statistics()
-        self.up_trend_detected_trend2 = self.d_trend.get_MK_results(
-            results_trend2, direction="up"
-        )["ds"]
-        self.down_trend_detected_trend2 = self.d_trend.get_MK_results(
-            results_trend2, direction="down"
-        )["ds"]
+        cls.detected_time_points_trend2 = cls.d_trend.detector(training_days=30)
+        cls.results_trend2 = cls.d_trend.get_MK_statistics()
 
         # trend data with seasonality
-        self.d_seas = MKDetector(data=trend_seas_data)
-        self.detected_time_points_seas = self.d_seas.detector(freq="weekly")
-        results_seas = self.d_seas.get_MK_statistics()
-        self.up_trend_detected_seas = self.d_seas.get_MK_results(
-            results_seas, direction="up"
-        )["ds"]
-        self.down_trend_detected_seas = self.d_seas.get_MK_results(
-            results_seas, direction="down"
-        )["ds"]
+        cls.d_seas = MKDetector(data=trend_seas_data)
+        cls.detected_time_points_seas = cls.d_seas.detector(freq="weekly")
+        cls.results_seas = cls.d_seas.get_MK_statistics()
 
         # trend data with seasonality anchor point
-        self.detected_time_points_seas2 = self.d_seas.detector(
+        cls.detected_time_points_seas2 = cls.d_seas.detector(
             training_days=30, freq="weekly"
         )
-        results_seas2 = self.d_seas.get_MK_statistics()
-        self.up_trend_detected_seas2 = self.d_seas.get_MK_results(
-            results_seas2, direction="up"
-        )["ds"]
-        self.down_trend_detected_seas2 = self.d_seas.get_MK_results(
-            results_seas2, direction="down"
-        )["ds"]
+        cls.results_seas2 = cls.d_seas.get_MK_statistics()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        # the detectors hold the data and MK statistics, free them before the
+        # next class sets up its own
+        del cls.d_no_trend, cls.d_trend, cls.d_seas
+
+    def tearDown(self) -> None:
+        # free the figures left by the plot tests
+        plt.close("all")
+
+    # the detected trends are derived on access, only by the tests using them
+    @property
+    def metadata_trend(self) -> MKChangePoint:
+        return self.detected_time_points_trend[0]
+
+    @property
+    def up_trend_detected_trend(self) -> np.ndarray:
+        return _detected_ds(self.d_trend, self.results_trend, "up")
+
+    @property
+    def down_trend_detected_trend(self) -> np.ndarray:
+        return _detected_ds(self.d_trend, self.results_trend, "down")
+
+    @property
+    def up_trend_detected_trend2(self) -> np.ndarray:
+        return _detected_ds(self.d_trend, self.results_trend2, "up")
+
+    @property
+    def down_trend_detected_trend2(self) -> np.ndarray:
+        return _detected_ds(self.d_trend, self.results_trend2, "down")
+
+    @property
+    def up_trend_detected_seas(self) -> np.ndarray:
+        return _detected_ds(self.d_seas, self.results_seas, "up")
+
+    @property
+    def down_trend_detected_seas(self) -> np.ndarray:
+        return _detected_ds(self.d_seas, self.results_seas, "down")
+
+    @property
+    def up_trend_detected_seas2(self) -> np.ndarray:
+        return _detected_ds(self.d_seas, self.results_seas2, "up")
+
+    @property
+    def down_trend_detected_seas2(self) -> np.ndarray:
+        return _detected_ds(self.d_seas, self.results_seas2, "down")
 
     # test for no trend data
     def test_no_trend_data(self) -> None:
@@ -101,108 +171,194 @@ class UnivariateMKDetectorTest(TestCase):
     def test_incr_trend(self) -> None:
         self.assertEqual(self.metadata_trend.trend_direction, "increasing")
 
-    @parameterized.expand([["up_trend_detected_trend"], ["up_trend_detected_seas"]])
-    def test_upward_after_start(self, up_trend_detected) -> None:
-        self.assertGreaterEqual(
-            attrgetter(up_trend_detected)(self).iloc[0],
-            self.time[0],
-            msg=f"The first {self.window_size}-days upward trend was not detected after it starts.",
-        )
-
-    @parameterized.expand(
-        [
-            ["up_trend_detected_trend", "t_change"],
-            ["up_trend_detected_seas", "t_change_seas"],
-        ]
-    )
-    def test_upward_before_end(self, up_trend_detected, t_change) -> None:
-        self.assertLessEqual(
-            attrgetter(up_trend_detected)(self).iloc[-1],
-            self.time[attrgetter(t_change)(self)[0] + self.window_size],
-            msg=f"The last {self.window_size}-days upward trend was not detected before it ends.",
-        )
-
-    @parameterized.expand(
-        [
-            ["down_trend_detected_trend", "t_change"],
-            ["down_trend_detected_seas", "t_change_seas"],
-        ]
-    )
-    def test_downward_after_start(self, down_trend_detected, t_change) -> None:
-        self.assertGreaterEqual(
-            attrgetter(down_trend_detected)(self).iloc[0],
-            self.time[attrgetter(t_change)(self)[0]],
-            msg=f"The first {self.window_size}-days downward trend was not detected after it starts.",
+    def test_float32_constant_no_trend(self) -> None:
+        constant = pd.Series(np.full(len(self.time), 0.1, dtype=np.float32))
+        d = MKDetector(data=TimeSeriesData(time=self.time, value=constant))
+        self.assertEqual(d.detector(window_size=self.window_size), [])
+
+    def test_short_deseasonalized_series(self) -> None:
+        # seasonality removal drops the first days, leaving no full window
+        for periods, freq in [(22, "weekly"), (40, "monthly")]:
+            time = pd.date_range("2020-01-01", periods=periods, freq="D")
+            value = pd.Series(np.arange(periods, dtype=float))
+            d = MKDetector(data=TimeSeriesData(time=time.to_series(), value=value))
+            with self.subTest(freq=freq):
+                self.assertEqual(d.detector(window_size=20, freq=freq), [])
+                self.assertTrue(d.get_MK_statistics().empty)
+
+    def test_MK_statistics_cache(self) -> None:
+        trend_data_2d, _ = _gen_trend(tuple(self._time_ns), ndim=2)
+        for data, multivariate in [(self.d_trend.data, False), (trend_data_2d, True)]:
+            d = MKDetector(data=data, multivariate=multivariate)
+            expected_d = MKDetector(data=data, multivariate=multivariate)
+            expected_d.detector(window_size=self.window_size)
+            expected = expected_d.get_MK_statistics()
+            with self.subTest(multivariate=multivariate), mock.patch.object(
+                d, "_get_MK_statistics", wraps=d._get_MK_statistics
+            ) as get_MK_statistics:
+                d.detector(window_size=self.window_size, direction="up")
+                MK_statistics = d.get_MK_statistics()
+                if multivariate:
+                    MK_statistics.Tau.iloc[0]["overall"] = 99.0
+                    MK_statistics.trend_direction.iloc[0]["overall"] = "edited"
+                else:
+                    MK_statistics.loc[0, ["trend_direction", "Tau"]] = ["edited", 99]
+                d.detector(training_days=30)
+                d.detector(window_size=self.window_size, direction="down")
+                self.assertEqual(get_MK_statistics.call_count, 2)
+                pd.testing.assert_frame_equal(d.get_MK_statistics(), expected)
+                d.detector(window_size=self.window_size, freq="weekly")
+                self.assertEqual(get_MK_statistics.call_count, 3)
+
+    def test_MK_statistics_cache_size(self) -> None:
+        d = MKDetector(data=self.d_trend.data)
+        for window_size in range(10, 10 + trend_mk._MK_STATISTICS_CACHE_SIZE + 1):
+            d.detector(window_size=window_size)
+        self.assertEqual(
+            len(d._MK_statistics_cache), trend_mk._MK_STATISTICS_CACHE_SIZE
         )
-
-    @parameterized.expand(
-        [
-            ["down_trend_detected_trend"],
-            ["down_trend_detected_trend2"],
-            ["down_trend_detected_seas"],
-            ["down_trend_detected_seas2"],
-        ]
-    )
-    def test_downward_before_end(self, down_trend_detected) -> None:
+        # the least recently used result was dropped
+        self.assertNotIn(10, [key[1] for key in d._MK_statistics_cache])
+
+    def test_MK_statistics_cache_extend(self) -> None:
+        time = pd.date_range("2020-01-01", periods=60, freq="D").to_series()
+        value = pd.Series(np.r_[np.arange(40.0), 40 - 2 * np.arange(20.0)])
+        data = TimeSeriesData(time=time[:40], value=value[:40])
+        d = MKDetector(data=data)
+        d.detector(training_days=30)
+        data.extend(TimeSeriesData(time=time[40:], value=value[40:]))
+        detected = d.detector(training_days=30)
+        fresh = MKDetector(data=TimeSeriesData(time=time, value=value))
         self.assertEqual(
-            attrgetter(down_trend_detected)(self).iloc[-1],
-            self.time[len(self.time) - 1],
-            msg=f"The last {self.window_size}-days downward trend was not detected before it ends.",
+            [(tp.start_time, tp.trend_direction) for tp in detected],
+            [
+                (tp.start_time, tp.trend_direction)
+                for tp in fresh.detector(training_days=30)
+            ],
         )
-
-    @parameterized.expand(
-        [
-            ["d_no_trend", "detected_time_points_no_trend"],
-            ["d_trend", "detected_time_points_trend"],
-            ["d_trend", "detected_time_points_trend2"],
-            ["d_seas", "detected_time_points_seas"],
-            ["d_seas", "detected_time_points_seas2"],
-        ]
-    )
-    def test_plot(self, detector, detected_time_points) -> None:
-        attrgetter(detector)(self).plot(attrgetter(detected_time_points)(self))
+        self.assertEqual(detected[0].start_time, pd.Timestamp("2020-02-29"))
+        self.assertEqual(detected[0].trend_direction, "decreasing")
+
+    def test_upward_after_start(self) -> None:
+        for up_trend_detected in ["up_trend_detected_trend", "up_trend_detected_seas"]:
+            with self.subTest(up_trend_detected=up_trend_detected):
+                self.assertGreaterEqual(
+                    getattr(self, up_trend_detected)[0],
+                    self.time_values[0],
+                    msg=f"The first {self.window_size}-days upward trend was not detected after it starts.",
+                )
+
+    def test_upward_before_end(self) -> None:
+        for up_trend_detected, t_change in [
+            ("up_trend_detected_trend", "t_change"),
+            ("up_trend_detected_seas", "t_change_seas"),
+        ]:
+            with self.subTest(up_trend_detected=up_trend_detected):
+                self.assertLessEqual(
+                    getattr(self, up_trend_detected)[-1],
+                    self.time_values[getattr(self, t_change)[0] + self.window_size],
+                    msg=f"The last {self.window_size}-days upward trend was not detected before it ends.",
+                )
+
+    def test_downward_after_start(self) -> None:
+        for down_trend_detected, t_change in [
+            ("down_trend_detected_trend", "t_change"),
+            ("down_trend_detected_seas", "t_change_seas"),
+        ]:
+            with self.subTest(down_trend_detected=down_trend_detected):
+                self.assertGreaterEqual(
+                    getattr(self, down_trend_detected)[0],
+                    self.time_values[getattr(self, t_change)[0]],
+                    msg=f"The first {self.window_size}-days downward trend was not detected after it starts.",
+                )
+
+    def test_downward_before_end(self) -> None:
+        for down_trend_detected in [
+            "down_trend_detected_trend",
+            "down_trend_detected_trend2",
+            "down_trend_detected_seas",
+            "down_trend_detected_seas2",
+        ]:
+            with self.subTest(down_trend_detected=down_trend_detected):
+                self.assertEqual(
+                    getattr(self, down_trend_detected)[-1],
+                    self.time_values[len(self.time) - 1],
+                    msg=f"The last {self.window_size}-days downward trend was not detected before it ends.",
+                )
+
+    def test_plot(self) -> None:
+        for detector, detected_time_points in [
+            ("d_no_trend", "detected_time_points_no_trend"),
+            ("d_trend", "detected_time_points_trend"),
+            ("d_trend", "detected_time_points_trend2"),
+            ("d_seas", "detected_time_points_seas"),
+            ("d_seas", "detected_time_points_seas2"),
+        ]:
+            with self.subTest(detected_time_points=detected_time_points):
+                getattr(self, detector).plot(getattr(self, detected_time_points))
 
 
 class MultivariateMKDetectorTest(TestCase):
-    def setUp(self) -> None:
-        self.window_size = 20
-        self.time = pd.Series(
-            pd.date_range(start="2020-01-01", end="2020-06-20", freq="1D")
-        )
-        self.ndim = 5
-        no_trend_data = gen_no_trend_data_ndim(time=self.time, ndim=self.ndim)
-        trend_data, self.t_change = gen_trend_data_ndim(time=self.time, ndim=self.ndim)
-        trend_seas_data, self.t_change_seas = gen_trend_data_ndim(
-            time=self.time, seasonality=0.07, ndim=self.ndim
+    pytestmark = pytest.mark.xdist_group(name="mk_multivariate")
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.window_size = 20
+        dates = pd.date_range(start="2020-01-01", end="2020-06-20", freq="1D")
+        cls.time = dates.to_series(index=range(len(dates)))
+        # compare datetime64 values in the tests rather than boxed Timestamps
+        cls.time_values = cls.time.values
+        cls._time_ns = cls.time_values.astype("datetime64[ns]").view("int64")
+        cls.ndim = 5
+        time_ns = tuple(cls._time_ns)
+        no_trend_data = _gen_no_trend(time_ns, ndim=cls.ndim)
+        trend_data, cls.t_change = _gen_trend(time_ns, ndim=cls.ndim)
+        trend_seas_data, cls.t_change_seas = _gen_trend(
+            time_ns, seasonality=0.07, ndim=cls.ndim
         )
 
         # no trend data
-        self.d_no_trend = MKDetector(data=no_trend_data)
-        self.detected_time_points_no_trend = self.d_no_trend.detector(
-            window_size=self.window_size
+        cls.d_no_trend = MKDetector(data=no_trend_data)
+        cls.detected_time_points_no_trend = cls.d_no_trend.detector(
+            window_size=cls.window_size
         )
 
         # trend data
-        self.d_trend = MKDetector(data=trend_data, multivariate=True)
-        self.detected_time_points_trend = self.d_trend.detector()
-        results_trend = self.d_trend.get_MK_statistics()
-        self.up_trend_detected_trend = self.d_trend.get_MK_results(
-            results_trend, direction="up"
-        )["ds"]
-        self.down_trend_detected_trend = self.d_trend.get_MK_results(
-            results_trend, direction="down"
-        )["ds"]
+        cls.d_trend = MKDetector(data=trend_data, multivariate=True)
+        cls.detected_time_points_trend = cls.d_trend.detector()
+        cls.results_trend = cls.d_trend.get_MK_statistics()
 
         # trend data with seasonality
-        self.d_seas = MKDetector(data=trend_seas_data, multivariate=True)
-        self.detected_time_points_seas = self.d_seas.detector(freq="weekly")
-        results_seas = self.d_seas.get_MK_statistics()
-        self.up_trend_detected_seas = self.d_seas.get_MK_results(
-            results_seas, direction="up"
-        )["ds"]
-        self.down_trend_detected_seas = self.d_seas.get_MK_results(
-            results_seas, direction="down"
-        )["ds"]
+        cls.d_seas = MKDetector(data=trend_seas_data, multivariate=True)
+        cls.detected_time_points_seas = cls.d_seas.detector(freq="weekly")
+        cls.results_seas = cls.d_seas.get_MK_statistics()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        # the detectors hold the data and MK statistics, free them before the
+        # next class sets up its own
+        del cls.d_no_trend, cls.d_trend, cls.d_seas
+
+    def tearDown(self) -> None:
+        # free the figures left by the plot tests
+        plt.close("all")
+
+    # the detected trends are derived on access, only by the tests using them
+    @property
+    def up_trend_detected_trend(self) -> np.ndarray:
+        return _detected_ds(self.d_trend, self.results_trend, "up")
+
+    @property
+    def down_trend_detected_trend(self) -> np.ndarray:
+        return _detected_ds(self.d_trend, self.results_trend, "down")
+
+    @property
+    def up_trend_detected_seas(self) -> np.ndarray:
+        return _detected_ds(self.d_seas, self.results_seas, "up")
+
+    @property
+    def down_trend_detected_seas(self) -> np.ndarray:
+        return _detected_ds(self.d_seas, self.results_seas, "down")
 
     # test for no trend data
     def test_no_trend_data(self) -> None:
@@ -211,54 +367,149 @@ class MultivariateMKDetectorTest(TestCase):
     def test_heatmap(self) -> None:
         self.d_no_trend.plot_heat_map()
 
-    @parameterized.expand([["up_trend_detected_trend"], ["up_trend_detected_seas"]])
-    def test_upward_after_start(self, up_trend_detected) -> None:
-        self.assertGreaterEqual(
-            attrgetter(up_trend_detected)(self).iloc[0],
-            self.time[0],
-            msg=f"The first {self.window_size}-days upward trend was not detected after it starts.",
-        )
-
-    @parameterized.expand(
-        [
-            ["up_trend_detected_trend", "t_change"],
-            ["up_trend_detected_seas", "t_change_seas"],
-        ]
-    )
-    def test_upward_before_end(self, up_trend_detected, t_change) -> None:
-        self.assertLessEqual(
-            attrgetter(up_trend_detected)(self).iloc[-1],
-            self.time[attrgetter(t_change)(self)[0] + self.window_size],
-            msg=f"The last {self.window_size}-days upward trend was not detected before it ends.",
-        )
-
-    @parameterized.expand(
-        [
-            ["down_trend_detected_trend", "t_change"],
-            ["down_trend_detected_seas", "t_change_seas"],
-        ]
-    )
-    def test_downward_after_start(self, down_trend_detected, t_change) -> None:
-        self.assertGreaterEqual(
-            attrgetter(down_trend_detected)(self).iloc[0],
-            self.time[attrgetter(t_change)(self)[0]],
-            msg=f"The first {self.window_size}-days downward trend was not detected after it starts.",
-        )
-
-    @parameterized.expand([["down_trend_detected_trend"], ["down_trend_detected_seas"]])
-    def test_downward_before_end(self, down_trend_detected) -> None:
-        self.assertEqual(
-            attrgetter(down_trend_detected)(self).iloc[-1],
-            self.time[len(self.time) - 1],
-            msg=f"The last {self.window_size}-days downward trend was not detected before it ends.",
-        )
-
-    @parameterized.expand(
-        [
-            ["d_no_trend", "detected_time_points_no_trend"],
-            ["d_trend", "detected_time_points_trend"],
-            ["d_seas", "detected_time_points_seas"],
-        ]
-    )
-    def test_plot(self, detector, detected_time_points) -> None:
-        attrgetter(detector)(self).plot(attrgetter(detected_time_points)(self))
+    def test_upward_after_start(self) -> None:
+        for up_trend_detected in ["up_trend_detected_trend", "up_trend_detected_seas"]:
+            with self.subTest(up_trend_detected=up_trend_detected):
+                self.assertGreaterEqual(
+                    getattr(self, up_trend_detected)[0],
+                    self.time_values[0],
+                    msg=f"The first {self.window_size}-days upward trend was not detected after it starts.",
+                )
+
+    def test_upward_before_end(self) -> None:
+        for up_trend_detected, t_change in [
+            ("up_trend_detected_trend", "t_change"),
+            ("up_trend_detected_seas", "t_change_seas"),
+        ]:
+            with self.subTest(up_trend_detected=up_trend_detected):
+                self.assertLessEqual(
+                    getattr(self, up_trend_detected)[-1],
+                    self.time_values[getattr(self, t_change)[0] + self.window_size],
+                    msg=f"The last {self.window_size}-days upward trend was not detected before it ends.",
+                )
+
+    def test_downward_after_start(self) -> None:
+        for down_trend_detected, t_change in [
+            ("down_trend_detected_trend", "t_change"),
+            ("down_trend_detected_seas", "t_change_seas"),
+        ]:
+            with self.subTest(down_trend_detected=down_trend_detected):
+                self.assertGreaterEqual(
+                    getattr(self, down_trend_detected)[0],
+                    self.time_values[getattr(self, t_change)[0]],
+                    msg=f"The first {self.window_size}-days downward trend was not detected after it starts.",
+                )
+
+    def test_downward_before_end(self) -> None:
+        for down_trend_detected in [
+            "down_trend_detected_trend",
+            "down_trend_detected_seas",
+        ]:
+            with self.subTest(down_trend_detected=down_trend_detected):
+                self.assertEqual(
+                    getattr(self, down_trend_detected)[-1],
+                    self.time_values[len(self.time) - 1],
+                    msg=f"The last {self.window_size}-days downward trend was not detected before it ends.",
+                )
+
+    def test_plot(self) -> None:
+        for detector, detected_time_points in [
+            ("d_no_trend", "detected_time_points_no_trend"),
+            ("d_trend", "detected_time_points_trend"),
+            ("d_seas", "detected_time_points_seas"),
+        ]:
+            with self.subTest(detected_time_points=detected_time_points):
+                getattr(self, detector).plot(getattr(self, detected_time_points))
+
+
+class MKKernelTest(TestCase):
+    def test_knight_matches_double_sum(self) -> None:
+        np.random.seed(0)
+        for ties in [False, True]:
+            for n in [1, 2, 3, 20, 101]:
+                x = np.random.randn(n)
+                if ties:
+                    x = np.round(x)
+                s = sum(np.sign(x[j] - x[i]) for i in range(n) for j in range(i + 1, n))
+                _, t = np.unique(x, return_counts=True)
+                tie_term = np.sum(t * (t - 1) * (2 * t + 5))
+                with self.subTest(ties=ties, n=n):
+                    self.assertEqual(_mk_s_knight(x), (s, tie_term))
+
+    def test_swar_matches_knight(self) -> None:
+        np.random.seed(0)
+        for n in [1, 2, 20, 64, _SWAR_MAX_LEN]:
+            for x in [np.random.randn(n), np.round(np.random.randn(n))]:
+                with self.subTest(n=n, ties=len(np.unique(x)) < n):
+                    self.assertEqual(_mk_s_swar(x), _mk_s_knight(x))
+
+    @skipIf(_no_numba, "requires numba")
+    def test_mk_rolling_matches_original_test(self) -> None:
+        np.random.seed(0)
+        window_size = 20
+        x = np.round(np.cumsum(np.random.randn(100)))
+        x[[10, 50, 51]] = np.nan
+        _, _, Tau, z = mk_rolling(x, window_size)
+        for i in range(len(x) - window_size + 1):
+            x_i = x[i : i + window_size]
+            _, p, Tau_i = _mk_original_test(x_i[~np.isnan(x_i)])
+            self.assertAlmostEqual(Tau[i], Tau_i)
+            self.assertAlmostEqual(2 * norm.sf(abs(z[i])), p)
+
+    def test_score_ndim_matches_knight(self) -> None:
+        np.random.seed(0)
+        x = np.round(np.cumsum(np.random.randn(30, 5), axis=0))
+        x[[3, 7], 1] = np.nan
+        # also split each series into blocks of 4 and then 1 rows
+        for max_pairs in [trend_mk._MK_NDIM_MAX_PAIRS, 4 * 30, 1]:
+            with mock.patch.object(trend_mk, "_MK_NDIM_MAX_PAIRS", max_pairs):
+                s, var_s, n = _mk_score_ndim(x.T)
+            for c in range(x.shape[1]):
+                x_c = x[~np.isnan(x[:, c]), c]
+                s_c, tie_term = _mk_s_knight(x_c)
+                n_c = len(x_c)
+                with self.subTest(max_pairs=max_pairs, c=c):
+                    self.assertEqual(n[c], n_c)
+                    self.assertEqual(s[c], s_c)
+                    self.assertAlmostEqual(
+                        var_s[c], (n_c * (n_c - 1) * (2 * n_c + 5) - tie_term) / 18
+                    )
+
+    def test_rolling_MKtest_matches_runDetector(self) -> None:
+        np.random.seed(0)
+        window_size = 20
+        x = np.round(np.cumsum(np.random.randn(60, 3), axis=0))
+        columns = ["ds", "trend_direction", "p", "Tau"]
+        # series shorter than the window have no look back windows
+        for periods, multivariate, no_numba in product(
+            [60, window_size, 15], [False, True], [True, False]
+        ):
+            if (multivariate or _no_numba) and not no_numba:
+                continue
+            time = pd.date_range("2020-01-01", periods=periods, freq="D")
+            value = x[:periods] if multivariate else x[:periods, :1]
+            ts = pd.DataFrame(
+                value, index=time, columns=["a", "b", "c"][: value.shape[1]]
+            )
+            d = MKDetector(
+                data=TimeSeriesData(
+                    time=time.to_series(), value=ts.reset_index(drop=True)
+                ),
+                multivariate=multivariate,
+            )
+            d.window_size = window_size
+            expected = pd.DataFrame(
+                [d.runDetector(ts.iloc[: k + 1]) for k in range(window_size, len(ts))],
+                columns=columns,
+            )
+            with self.subTest(
+                periods=periods, multivariate=multivariate, no_numba=no_numba
+            ):
+                # a small batch size also covers the batching of _mk_score_ndim
+                with mock.patch.object(
+                    trend_mk, "_no_numba", no_numba
+                ), mock.patch.object(
+                    trend_mk, "_MK_NDIM_MAX_PAIRS", 3 * window_size**2
+                ):
+                    result = d._rolling_MKtest(ts)
+                pd.testing.assert_frame_equal(result, expected)